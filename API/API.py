@@ -1,21 +1,49 @@
 import os
-from flask import Flask, request, jsonify, send_from_directory, abort
+from flask import Flask, Request, request, jsonify, send_from_directory, abort
+from flask.json.provider import JSONProvider
+import orjson # Fast JSON serialization
 from flask_sqlalchemy import SQLAlchemy
 from flask_apscheduler import APScheduler
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
-from email import encoders
-import pytz # For timezone handling
-import uuid # To generate unique filenames
+from email import policy as email_policy
+import base64
+import functools
+import mmap
+import re
+import secrets # To generate unique filenames
+import mimetypes # To label attachments handed off to the reverse proxy
+from urllib.parse import quote
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException, NotFound, RequestEntityTooLarge
+import shutil
+import io
+import tempfile
 from flask_cors import CORS # To allow requests from your React frontend
 from dotenv import load_dotenv # Import load_dotenv
-from sqlalchemy import inspect # Import inspect
+from sqlalchemy import inspect, event, update, delete, select, bindparam, case, tuple_ # Import inspect
+from sqlalchemy.orm import raiseload
+from sqlalchemy.engine import Engine, make_url
+import sqlite3
 from sqlalchemy.exc import OperationalError # Import specific exception
 import logging # Import logging module
+import threading
+import queue
+import time
+import types
+import sys
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl # POSIX file locking, used so only one worker runs the scheduler
+except ImportError:
+    fcntl = None
+try:
+    import ciso8601 # Optional C parser for send_datetime; datetime.fromisoformat is used without it
+except ImportError:
+    ciso8601 = None
 
 # --- Configure basic logging ---
 # This helps ensure we see messages even if print() is buffered
@@ -29,13 +57,56 @@ load_dotenv()
 log.info(".env file loaded.")
 
 # --- Flask App Configuration ---
+class ORJSONProvider(JSONProvider):
+    """
+    JSON provider backed by orjson, used by jsonify().
+    Serializes datetime objects natively as ISO 8601 strings, treating naive ones as UTC.
+    """
+    # Datetimes are stored as naive UTC, so mark them as UTC (with a 'Z') on the way out
+    options = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response, skipping the str round trip in dumps()
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self.options), mimetype='application/json')
+
+class UploadRequest(Request):
+    """
+    Request that spools multipart file uploads straight to a temporary file in the
+    staging folder, instead of holding uploads under 500KB in memory.
+    save_upload() can then copy them with os.sendfile on the same filesystem.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.TemporaryFile(dir=UPLOAD_STAGING_FOLDER)
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+app.request_class = UploadRequest
 
 # Configure SQLite database
 # Using a relative path for the database file
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///' + os.path.join(BASE_DIR, 'time_capsules.db')) # Use DATABASE_URL env var if available
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False # Suppress a warning
+# pre_ping drops stale connections
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
+database_url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+if not (database_url.get_backend_name() == 'sqlite' and database_url.database in (None, '', ':memory:')):
+    # Room for concurrent requests plus the scheduler's sending threads. In-memory SQLite gets a
+    # StaticPool from Flask-SQLAlchemy instead, which takes no pool sizing
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(pool_size=10, max_overflow=20)
+if database_url.get_backend_name() == 'sqlite':
+    # Pooled connections move between threads; wait up to 30s for a writer instead of failing with "database is locked"
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {'check_same_thread': False, 'timeout': 30}
+    if sqlite3.sqlite_version_info < (3, 35):
+        # The scheduler's claim and the delete endpoints use UPDATE/DELETE ... RETURNING
+        log.error(f"SQLite {sqlite3.sqlite_version} is too old; 3.35 or newer is required. Sending and deleting capsules will fail.")
 log.info(f"SQLALCHEMY_DATABASE_URI set to: {app.config['SQLALCHEMY_DATABASE_URI']}")
 
 
@@ -46,9 +117,25 @@ UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 # For Render Free tier, local uploads will NOT persist.
 os.makedirs(UPLOAD_FOLDER, exist_ok=True) # Create upload directory if it doesn't exist
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Resolved once; attachment paths are stored relative to this and checked against it
+ABS_UPLOAD_FOLDER = os.path.realpath(UPLOAD_FOLDER)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Max upload size (e.g., 16MB)
+# Uploads are written here during the request and moved into UPLOAD_FOLDER by a background thread
+UPLOAD_STAGING_FOLDER = os.environ.get('UPLOAD_STAGING_FOLDER', os.path.join(UPLOAD_FOLDER, '.staging'))
+os.makedirs(UPLOAD_STAGING_FOLDER, exist_ok=True)
+UPLOAD_CHUNK_SIZE = 64 * 1024 # Read size when streaming a raw upload to disk
+UPLOAD_COPY_BUFFER = 1024 * 1024 # Buffer size when copying an already received upload
 log.info(f"UPLOAD_FOLDER set to: {app.config['UPLOAD_FOLDER']}")
 
+# Let the reverse proxy send attachment bytes (sendfile) instead of streaming them through Python.
+# nginx: set ATTACHMENT_ACCEL_PREFIX=/internal-uploads/ and add
+#   location /internal-uploads/ { internal; alias /path/to/API/uploads/; }
+# Apache with mod_xsendfile: set USE_X_SENDFILE=True (handled by Flask's send_file)
+app.config['ATTACHMENT_ACCEL_PREFIX'] = os.environ.get('ATTACHMENT_ACCEL_PREFIX')
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', 'False').lower() == 'true'
+# Stored attachments are never rewritten (unique file names), so browsers may keep them this long (seconds)
+app.config['ATTACHMENT_MAX_AGE'] = int(os.environ.get('ATTACHMENT_MAX_AGE', 24 * 60 * 60))
+
 
 # Configure email sending
 # Use environment variables for sensitive info
@@ -59,96 +146,291 @@ app.config['MAIL_USE_SSL'] = os.environ.get('MAIL_USE_SSL', 'False').lower() ==
 app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME') # Your email address
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD') # Your email password or app password
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', app.config['MAIL_USERNAME'])
+app.config['MAIL_TIMEOUT'] = float(os.environ.get('MAIL_TIMEOUT', 30)) # Seconds before a stalled SMTP server is given up on
 log.info(f"Email configuration loaded. MAIL_SERVER: {app.config['MAIL_SERVER']}, MAIL_USERNAME: {app.config['MAIL_USERNAME']}")
+# Read-only snapshot of the mail settings used by the sending code, taken once at startup
+SMTP_CONFIG = types.SimpleNamespace(
+    server=app.config['MAIL_SERVER'],
+    port=app.config['MAIL_PORT'],
+    use_tls=app.config['MAIL_USE_TLS'],
+    use_ssl=app.config['MAIL_USE_SSL'],
+    user=app.config['MAIL_USERNAME'],
+    password=app.config['MAIL_PASSWORD'],
+    sender=app.config['MAIL_DEFAULT_SENDER'],
+    timeout=app.config['MAIL_TIMEOUT'],
+)
+SMTP_CREDENTIALS_SET = bool(SMTP_CONFIG.user and SMTP_CONFIG.password)
+if not SMTP_CREDENTIALS_SET:
+    log.warning("MAIL_USERNAME or MAIL_PASSWORD not set. Scheduled emails will fail until they are configured.")
 
 
 # Configure APScheduler
 app.config['SCHEDULER_API_ENABLED'] = False # Disable the built-in API endpoints
+# The poll job only waits on SQLite and the smtp_pool, so a small thread pool leaves room for other jobs
+app.config['SCHEDULER_EXECUTORS'] = {'default': {'type': 'threadpool', 'max_workers': 4}}
+# One run of a job at a time; runs missed while one was busy are collapsed into a single run
+app.config['SCHEDULER_JOB_DEFAULTS'] = {'coalesce': True, 'max_instances': 1}
+# Only the process holding this lock runs the scheduler, so N Gunicorn workers don't send every email N times
+SCHEDULER_LOCK_FILE = os.environ.get('SCHEDULER_LOCK_FILE', os.path.join(BASE_DIR, 'scheduler.lock'))
 scheduler = APScheduler()
 log.info("APScheduler initialized.")
 
 
 # Initialize extensions
 db = SQLAlchemy(app)
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Uses WAL with synchronous=NORMAL on SQLite connections, so a commit
+    no longer waits for a full fsync of the rollback journal and readers
+    don't block the scheduler's writes. Temp tables and indexes stay in
+    memory and up to 256MB of the database file is memory-mapped.
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA mmap_size=268435456')
+        cursor.close()
 CORS(app) # Enable CORS for all routes
 log.info("SQLAlchemy and CORS initialized.")
 
 # --- Database Model ---
+def utc_now_naive():
+    """
+    Returns the current UTC time without tzinfo, the form datetimes are stored in.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class Capsule(db.Model):
+    # The scheduler looks for unsent capsules by send time every run. The partial index only holds
+    # pending/failed rows, so it stays the size of the backlog however many sent capsules pile up
+    __table_args__ = (
+        db.Index('ix_capsule_unsent', 'send_datetime_utc',
+                 sqlite_where=db.text("status IN ('pending', 'failed')"),
+                 postgresql_where=db.text("status IN ('pending', 'failed')")),
+        # The capsule list is ordered by creation time
+        db.Index('ix_capsule_created_at', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     recipient_email = db.Column(db.String(120), nullable=False)
     subject = db.Column(db.String(255), nullable=False)
     body = db.Column(db.Text, nullable=False)
-    # Store datetime as UTC and convert for display/input
-    send_datetime_utc = db.Column(db.DateTime(timezone=True), nullable=False)
-    attachment_path = db.Column(db.String(255), nullable=True) # Path to stored file
+    # Store datetime as naive UTC so SQLite compares the raw column values (and can use the index)
+    send_datetime_utc = db.Column(db.DateTime, nullable=False)
+    attachment_path = db.Column(db.String(255), nullable=True) # Stored file name inside UPLOAD_FOLDER (full path in older rows)
     attachment_filename = db.Column(db.String(255), nullable=True) # Original filename
-    status = db.Column(db.String(20), default='pending') # 'pending', 'sent', or 'failed'
+    status = db.Column(db.String(20), default='pending', server_default='pending') # 'uploading', 'pending', 'sending', 'sent', or 'failed'
     error_message = db.Column(db.Text, nullable=True) # Store error message if sending fails
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=utc_now_naive) # Naive UTC, evaluated per row
 
     def __repr__(self):
         return f'<Capsule {self.subject} to {self.recipient_email}>'
 
-    # Helper to convert UTC datetime to a display format (e.g., ISO 8601 for frontend)
+    # Helper for API responses; datetimes are left as-is for the JSON provider to format as UTC ISO 8601
     def to_dict(self):
         return {
             'id': self.id,
             'recipient_email': self.recipient_email,
             'subject': self.subject,
             'body': self.body,
-            # Convert UTC to ISO format string for frontend
-            'send_datetime': self.send_datetime_utc.isoformat() if self.send_datetime_utc else None,
+            'send_datetime': self.send_datetime_utc,
             'attachment_filename': self.attachment_filename,
             'status': self.status,
             'error_message': self.error_message, # Include error message
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at
         }
 
 # --- Scheduled Email Sending Job ---
+# How often (in sends) to check a reused SMTP connection with NOOP
+SMTP_NOOP_INTERVAL = int(os.environ.get('MAIL_NOOP_INTERVAL', 10))
+# Give up on a batch once server failures hit more than a third of it, but only for larger batches
+SMTP_ABORT_MIN_BATCH = 30
+# Batches larger than SMTP_POOL_MIN_BATCH are sent over SMTP_POOL_SIZE connections in parallel
+SMTP_POOL_SIZE = max(1, int(os.environ.get('MAIL_POOL_SIZE', 4)))
+SMTP_POOL_MIN_BATCH = 20
+# Sends per second across all connections (0 disables the limit), to stay under the provider's rate limit
+MAIL_SEND_RATE = float(os.environ.get('MAIL_SEND_RATE', 10))
+# Attachments larger than this are base64-encoded and written to the SMTP socket chunk by chunk
+ATTACHMENT_STREAM_THRESHOLD = 1024 * 1024
+# Multiple of 57 bytes so every chunk encodes to whole 76-character base64 lines
+ATTACHMENT_CHUNK_SIZE = 57 * 1024
+# How many encoded attachments (each at most ATTACHMENT_STREAM_THRESHOLD before encoding) to keep in memory
+ATTACHMENT_CACHE_SIZE = 8
+# Stands in for the attachment payload when the rest of the message is generated
+ATTACHMENT_PLACEHOLDER = 'TIMECAPSULE-STREAMED-ATTACHMENT'
+# Poll every SCHEDULER_INTERVAL seconds while there is work, and back off to
+# SCHEDULER_IDLE_INTERVAL after more than SCHEDULER_IDLE_POLLS empty polls in a row
+SCHEDULER_INTERVAL = 60
+SCHEDULER_IDLE_INTERVAL = 300
+SCHEDULER_IDLE_POLLS = 5
+# A poll that starts this many seconds late still runs; missed polls are collapsed into one
+SCHEDULER_MISFIRE_GRACE = 60
+
+# Pending capsules, plus failed ones to retry. Rendered inline rather than as bound parameters,
+# so SQLite can match it against ix_capsule_unsent's WHERE clause and use the partial index
+CAPSULE_UNSENT = Capsule.status.in_(bindparam('unsent_statuses', ('pending', 'failed'), expanding=True, literal_execute=True))
+
+# Capsules are claimed and sent in batches of this many, so a large backlog is never loaded at once
+SCHEDULER_BATCH_SIZE = 100
+
+# Only the columns needed to send are loaded (error_message and friends are skipped)
+SEND_COLUMNS = (
+    Capsule.id, Capsule.recipient_email, Capsule.subject, Capsule.body,
+    Capsule.send_datetime_utc, Capsule.attachment_path, Capsule.attachment_filename,
+)
+
+# Built once; the status, cutoff and keyset position are bound per batch so the compiled SQL is reused from
+# SQLAlchemy's cache. Claims the next batch of due capsules with claim_status, in (send_datetime_utc, id)
+# order after (after_send, after_id) and skipping skip_ids, by flipping them to 'sending' and returns them,
+# in one statement, so a capsule can't be picked up twice by overlapping runs. That order is
+# ix_capsule_unsent's, so no sort is needed; CAPSULE_UNSENT stays in so SQLite still picks that index.
+# UPDATE ... RETURNING needs SQLite 3.35 or newer.
+CLAIM_CAPSULES_STMT = (
+    update(Capsule)
+    .where(Capsule.id.in_(
+        select(Capsule.id)
+        .where(
+            CAPSULE_UNSENT,
+            Capsule.status == bindparam('claim_status'),
+            Capsule.id.not_in(bindparam('skip_ids', expanding=True, literal_execute=True)),
+            Capsule.send_datetime_utc <= bindparam('cutoff'),
+            tuple_(Capsule.send_datetime_utc, Capsule.id) > tuple_(bindparam('after_send', type_=db.DateTime), bindparam('after_id', type_=db.Integer)),
+        )
+        .order_by(Capsule.send_datetime_utc, Capsule.id)
+        .limit(SCHEDULER_BATCH_SIZE)
+    ))
+    .values(status='sending')
+    .returning(*SEND_COLUMNS)
+    .execution_options(synchronize_session=False)
+)
+
+empty_polls = 0 # Consecutive polls that found nothing to send
+poll_interval = SCHEDULER_INTERVAL # Interval the poll job is currently scheduled with
+poll_lock = threading.Lock() # Keeps the interval job and the one-shot due job from overlapping
+
+def poll_scheduled_emails():
+    """
+    Scheduler entry point. Runs send_scheduled_emails() and adapts the poll interval:
+    after a run of empty polls it backs off to SCHEDULER_IDLE_INTERVAL, plus a one-shot
+    run at the next due send time if that comes sooner.
+    """
+    global empty_polls
+    if not poll_lock.acquire(blocking=False):
+        log.info("Previous poll still running. Skipping this one.")
+        return
+    try:
+        processed = send_scheduled_emails()
+        if processed is None:
+            return # Job failed; keep the current interval
+        empty_polls = 0 if processed else empty_polls + 1
+
+        if empty_polls > SCHEDULER_IDLE_POLLS:
+            set_poll_interval(SCHEDULER_IDLE_INTERVAL)
+            schedule_next_due_run()
+        else:
+            set_poll_interval(SCHEDULER_INTERVAL)
+    finally:
+        poll_lock.release()
+
+
+def set_poll_interval(seconds):
+    """
+    Reschedules the poll job if its interval changes.
+    """
+    global poll_interval
+    if seconds == poll_interval:
+        return
+    scheduler.modify_job('send_emails_job', trigger='interval', seconds=seconds)
+    poll_interval = seconds
+    log.info(f"Scheduler poll interval set to {seconds} seconds.")
+
+
+def schedule_next_due_run():
+    """
+    While backed off, adds a one-shot run at the earliest pending send time
+    if it falls before the next idle poll.
+    """
+    with app.app_context():
+        next_due = db.session.query(db.func.min(Capsule.send_datetime_utc)).filter(CAPSULE_UNSENT).scalar()
+    if next_due is None or next_due >= utc_now_naive() + timedelta(seconds=poll_interval):
+        return
+    scheduler.add_job(id='send_emails_due_job', func=poll_scheduled_emails, trigger='date',
+                      run_date=next_due.replace(tzinfo=timezone.utc), replace_existing=True,
+                      misfire_grace_time=SCHEDULER_MISFIRE_GRACE)
+    log.info(f"Scheduled a one-shot poll for the next due capsule at {next_due.isoformat()} UTC.")
+
+
+def wake_scheduler(send_datetime_utc):
+    """
+    Called when a capsule is created. If this process runs the backed-off scheduler and
+    the capsule is due before the next idle poll, switch back to the normal interval.
+    Other worker processes can't reach the scheduler, so there the delay is at most
+    SCHEDULER_IDLE_INTERVAL.
+    """
+    global empty_polls
+    if not scheduler.running or poll_interval == SCHEDULER_INTERVAL:
+        return
+    if send_datetime_utc < utc_now_naive() + timedelta(seconds=poll_interval):
+        empty_polls = 0
+        set_poll_interval(SCHEDULER_INTERVAL)
+
 def send_scheduled_emails():
     """
     Scheduled job to find pending capsules with a send date in the past
     and send the emails.
+    Due capsules are claimed and sent SCHEDULER_BATCH_SIZE at a time. Small batches share a
+    single SMTP connection; large ones are split over a small pool of them. Pending capsules are
+    sent before failed ones are retried.
+    Returns the number of pending capsules found, or None if the job failed. Retries aren't counted,
+    so capsules that keep failing (like one whose attachment is gone) don't stop the poll backing off.
     """
     # This log message indicates the function is being called
     log.info("send_scheduled_emails job started.")
     # Use app.app_context() to ensure the database and app config are available
     with app.app_context():
         try:
-            # Use timezone-aware datetime for comparison
-            now_utc = datetime.now(timezone.utc)
-            # print(f"Scheduler running at UTC: {now_utc.isoformat()}") # Keep this for debugging if needed
-
-            # Query for pending capsules where send_datetime_utc is less than or equal to now_utc
-            # Also include capsules that previously failed, to potentially retry
-            pending_capsules = Capsule.query.filter(
-                (Capsule.status == 'pending') | (Capsule.status == 'failed'), # Include failed for retry
-                Capsule.send_datetime_utc <= now_utc
-            ).all()
-
-            if pending_capsules: # Only print if there are capsules to process
-               log.info(f"Found {len(pending_capsules)} pending/failed capsules to process.")
-            # else:
-               # log.info("Found 0 pending/failed capsules to process.") # Uncomment if you want this log always
+            # Only one run is ever active (the scheduler lock and max_instances=1), so anything still in
+            # 'sending' was left behind by an earlier run that died mid-batch
+            release_claimed_capsules()
 
+            # Naive UTC, matching how send_datetime_utc is stored
+            now_utc = utc_now_naive()
+            # print(f"Scheduler running at UTC: {now_utc.isoformat()}") # Keep this for debugging if needed
 
-            for capsule in pending_capsules:
-                try:
-                    log.info(f"Attempting to process capsule ID: {capsule.id}, Subject: {capsule.subject}, Scheduled UTC: {capsule.send_datetime_utc.isoformat()}")
-                    send_email(capsule)
-                    capsule.status = 'sent'
-                    capsule.error_message = None # Clear any previous error on success
+            found = 0
+            failed_ids = [] # Failed earlier in this run, so the retry pass doesn't send them again
+            # Pending capsules first, then retries of failed ones, so a backlog of capsules that keep
+            # failing can't hold up new ones that are due
+            for claim_status in ('pending', 'failed'):
+                # Keyset position, so capsules that fail in this run aren't claimed again
+                after_send, after_id = datetime.min, 0
+                while True:
+                    # Claim capsules with claim_status where send_datetime_utc is less than or equal to now_utc
+                    pending_capsules = db.session.execute(CLAIM_CAPSULES_STMT, {
+                        'claim_status': claim_status, 'skip_ids': failed_ids,
+                        'cutoff': now_utc, 'after_send': after_send, 'after_id': after_id,
+                    }).all()
                     db.session.commit()
-                    log.info(f"Successfully sent capsule ID: {capsule.id}")
-                except Exception as e:
-                    # Log the error and update status and error message in DB
-                    log.error(f"Failed to send email for capsule ID {capsule.id}: {e}")
-                    capsule.status = 'failed'
-                    capsule.error_message = str(e) # Store the error message
-                    db.session.commit() # Commit the status and error message update
-                    # No rollback here, as we want to save the failed status and error message
-                    # db.session.rollback() # Rollback session in case of error during commit (less likely here)
+                    if not pending_capsules:
+                        break
+                    if claim_status == 'pending':
+                        found += len(pending_capsules)
+                    after_send, after_id = max((capsule.send_datetime_utc, capsule.id) for capsule in pending_capsules)
+                    log.info(f"Claimed {len(pending_capsules)} {claim_status} capsules to process.")
+
+                    progress, results = send_batch(pending_capsules)
+                    if progress.should_abort():
+                        # The server is failing; leave the rest for the next run
+                        return found
+                    failed_ids.extend(result['id'] for result in results if result['status'] != 'sent')
+                    if len(pending_capsules) < SCHEDULER_BATCH_SIZE:
+                        break
+
+            return found
 
         except OperationalError as e:
              log.error(f"Database Operational Error in scheduler job: {e}")
@@ -156,68 +438,660 @@ def send_scheduled_emails():
         except Exception as e:
             log.error(f"An unexpected error occurred in scheduler job: {e}")
             # Ensure session is clean even for unexpected errors
-            if db.session.dirty or db.session.pending or db.session.deleted:
-                 db.session.rollback()
+            db.session.rollback()
+
+
+def send_batch(pending_capsules):
+    """
+    Sends one claimed batch and saves the results. Capsules left unsent (the batch was
+    aborted) are released back to their previous status. Returns the batch's BatchProgress
+    and the status updates of the capsules it processed.
+    """
+    progress = BatchProgress(len(pending_capsules))
+    results = [] # Status updates, written together once the batch is done
+    try:
+        if len(pending_capsules) > SMTP_POOL_MIN_BATCH:
+            # Large batch: round-robin slices, each sent by its own thread over its own connection
+            slices = [pending_capsules[i::SMTP_POOL_SIZE] for i in range(SMTP_POOL_SIZE)]
+            for slice_results in smtp_pool.map(lambda capsules: send_capsules(capsules, progress), slices):
+                results.extend(slice_results)
+        else:
+            results = send_capsules(pending_capsules, progress)
+    finally:
+        try:
+            # Save whatever was processed, even if sending stopped early
+            save_send_results(results)
+        finally:
+            # Runs even if the save failed (rolling it back first), so unsent capsules don't stay in 'sending'
+            db.session.rollback()
+            processed = {result['id'] for result in results}
+            release_claimed_capsules([capsule.id for capsule in pending_capsules if capsule.id not in processed])
+    return progress, results
+
+
+def release_claimed_capsules(capsule_ids=None):
+    """
+    Puts capsules left in 'sending' back to 'failed' (if they carry an error from an
+    earlier attempt) or 'pending'. With no ids, releases every capsule in 'sending',
+    which are ones an earlier run (or process) claimed but never finished.
+    """
+    stmt = (update(Capsule).where(Capsule.status == 'sending')
+            .values(status=case((Capsule.error_message.is_(None), 'pending'), else_='failed')))
+    if capsule_ids is not None:
+        if not capsule_ids:
+            return
+        stmt = stmt.where(Capsule.id.in_(capsule_ids))
+    result = db.session.execute(stmt, execution_options={'synchronize_session': False})
+    db.session.commit()
+    if result.rowcount:
+        log.info(f"Released {result.rowcount} claimed capsules for the next run.")
+
+
+def send_capsules(capsules, progress):
+    """
+    Sends capsules over one reused SMTP connection.
+    Returns their status updates as {'id', 'status', 'error_message'} dicts.
+    """
+    server = None # Opened lazily and reused for all capsules
+    sends_since_check = 0
+    results = []
+    try:
+        for index, capsule in enumerate(capsules):
+            # Stop hammering a server that keeps rejecting us; remaining capsules are retried next run
+            if progress.should_abort():
+                log.error(f"Aborting batch after {progress.failures} failures out of {progress.total} capsules.")
+                break
+            msg = None
+            try:
+                log.info(f"Attempting to process capsule ID: {capsule.id}, Subject: {capsule.subject}, Scheduled UTC: {capsule.send_datetime_utc.isoformat()}")
+
+                # Built before connecting, so a capsule that can't be built (its attachment is missing)
+                # fails without costing a connect and login
+                msg = build_message(capsule)
+
+                if server is None:
+                    server = open_smtp()
+                    sends_since_check = 0
+                elif sends_since_check >= SMTP_NOOP_INTERVAL:
+                    # Periodic health check of the reused connection
+                    if not smtp_is_alive(server):
+                        log.warning("SMTP connection failed health check. Reconnecting.")
+                        close_smtp(server)
+                        server = None
+                        server = open_smtp()
+                    sends_since_check = 0
+
+                if smtp_rate_limiter is not None:
+                    smtp_rate_limiter.acquire()
+                try:
+                    send_message(server, capsule, msg)
+                except smtplib.SMTPServerDisconnected:
+                    # The server dropped us mid-batch; reconnect once and retry this capsule
+                    log.warning(f"SMTP server disconnected while sending capsule ID {capsule.id}. Reconnecting.")
+                    close_smtp(server)
+                    server = None
+                    server = open_smtp()
+                    send_message(server, capsule, msg)
+                sends_since_check += 1
+
+                # Clear any previous error on success
+                results.append({'id': capsule.id, 'status': 'sent', 'error_message': None})
+                log.info(f"Successfully sent capsule ID: {capsule.id}")
+            except Exception as e:
+                if is_server_failure(e):
+                    progress.record_failure()
+                # Log the error and record the failed status and error message
+                log.error(f"Failed to send email for capsule ID {capsule.id}: {e}")
+                results.append({'id': capsule.id, 'status': 'failed', 'error_message': str(e)})
+                if server is None and msg is not None:
+                    # Connecting or logging in failed; don't repeat the login for every remaining capsule
+                    log.error(f"No SMTP connection. Marking the remaining {len(capsules) - index - 1} capsules as failed until the next run.")
+                    results.extend({'id': rest.id, 'status': 'failed', 'error_message': str(e)} for rest in capsules[index + 1:])
+                    break
+    finally:
+        if server is not None:
+            close_smtp(server)
+    return results
+
+
+def is_server_failure(error):
+    """
+    Returns True if a send failed because of the connection or the server (connect/login
+    errors, a dropped connection, 4xx replies), rather than because of the capsule itself,
+    like a rejected recipient or a missing attachment.
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPAuthenticationError)):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    # SMTPException subclasses OSError, so only socket-level errors are left here
+    return isinstance(error, OSError) and not isinstance(error, (smtplib.SMTPException, FileNotFoundError))
+
+
+class BatchProgress:
+    """
+    Server failure count for one batch, shared by the threads sending it, for the early-abort rule.
+    Capsules rejected for their own reasons don't count, so a run of bad capsules can't stop the
+    good ones behind them from being sent.
+    """
+    def __init__(self, total):
+        self.total = total
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def should_abort(self):
+        return self.total >= SMTP_ABORT_MIN_BATCH and self.failures > self.total // 3
 
 
-def send_email(capsule):
+class RateLimiter:
     """
-    Sends an email for a given capsule object.
+    Token bucket allowing `rate` sends per second (with bursts of up to `burst`),
+    shared by all sending threads.
     """
-    if not app.config.get('MAIL_USERNAME') or not app.config.get('MAIL_PASSWORD'):
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+smtp_rate_limiter = RateLimiter(MAIL_SEND_RATE, SMTP_POOL_SIZE) if MAIL_SEND_RATE > 0 else None
+# Long-lived sending threads, so SMTP work for large batches doesn't start new threads every run
+smtp_pool = ThreadPoolExecutor(max_workers=SMTP_POOL_SIZE, thread_name_prefix='smtp-sender')
+
+
+def save_send_results(results):
+    """
+    Writes the status of each processed capsule in a single commit, instead of one commit per capsule:
+    sent capsules with one UPDATE ... WHERE id IN (...), failed ones (each with its own error) in one
+    executemany UPDATE by id.
+    results is a list of {'id', 'status', 'error_message'} dicts.
+    """
+    if not results:
+        return
+    sent_ids = [result['id'] for result in results if result['status'] == 'sent']
+    failed = [result for result in results if result['status'] != 'sent']
+    if sent_ids:
+        db.session.execute(update(Capsule).where(Capsule.id.in_(sent_ids)).values(status='sent', error_message=None),
+                           execution_options={'synchronize_session': False})
+    if failed:
+        # Core rather than the ORM bulk UPDATE by primary key, which raises StaleDataError (and rolls
+        # back the sent updates too) if a capsule was deleted while its batch was sending
+        db.session.execute(
+            update(Capsule.__table__).where(Capsule.__table__.c.id == bindparam('b_id'))
+            .values(status=bindparam('b_status'), error_message=bindparam('b_error_message')),
+            [{'b_id': result['id'], 'b_status': result['status'], 'b_error_message': result['error_message']} for result in failed],
+        )
+    db.session.commit()
+    log.info(f"Saved status for {len(results)} capsules.")
+
+
+def open_smtp():
+    """
+    Opens an SMTP connection using the mail settings in SMTP_CONFIG and logs in.
+    The caller is responsible for closing it with close_smtp().
+    """
+    if not SMTP_CREDENTIALS_SET:
         raise EnvironmentError("Email credentials not configured. Cannot send email.")
 
+    try:
+        if SMTP_CONFIG.use_ssl:
+            # SSL needs a different server object from the start
+            server = smtplib.SMTP_SSL(SMTP_CONFIG.server, SMTP_CONFIG.port, timeout=SMTP_CONFIG.timeout)
+        else:
+            server = smtplib.SMTP(SMTP_CONFIG.server, SMTP_CONFIG.port, timeout=SMTP_CONFIG.timeout)
+            server.ehlo() # Can be omitted
+            if SMTP_CONFIG.use_tls:
+                 server.starttls() # Secure the connection
+                 server.ehlo() # Can be omitted
+    except Exception as e:
+        log.error(f"SMTP connection error occurred: {e}")
+        raise
+
+    try:
+        server.login(SMTP_CONFIG.user, SMTP_CONFIG.password)
+    except Exception as e:
+        log.error(f"SMTP login error occurred: {e}")
+        server.close()
+        raise
+
+    log.info("SMTP connection opened.")
+    return server
+
+
+def close_smtp(server):
+    """
+    Closes an SMTP connection, ignoring errors from an already dropped connection.
+    """
+    try:
+        server.quit()
+    except (smtplib.SMTPException, OSError):
+        server.close()
+
+
+def smtp_is_alive(server):
+    """
+    Returns True if the server still answers NOOP with 250.
+    """
+    try:
+        return server.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
+        return False
+
+
+def build_message(capsule):
+    """
+    Builds the email message for a given capsule object.
+    Capsules without an attachment get a single text/plain message, skipping the
+    multipart wrapper and its boundary.
+    """
+    if not capsule.attachment_path:
+        msg = MIMEText(capsule.body, 'plain')
+        msg['From'] = SMTP_CONFIG.sender
+        msg['To'] = capsule.recipient_email
+        msg['Subject'] = capsule.subject
+        return msg
+
     msg = MIMEMultipart()
-    msg['From'] = app.config['MAIL_DEFAULT_SENDER']
+    msg['From'] = SMTP_CONFIG.sender
     msg['To'] = capsule.recipient_email
     msg['Subject'] = capsule.subject
 
     # Attach body
     msg.attach(MIMEText(capsule.body, 'plain'))
 
-    # Attach file if exists
-    if capsule.attachment_path and os.path.exists(capsule.attachment_path):
-        try:
-            with open(capsule.attachment_path, 'rb') as f:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(f.read())
-            encoders.encode_base64(part)
-            # Use the original filename for the attachment in the email
-            part.add_header(
-                'Content-Disposition',
-                f'attachment; filename="{capsule.attachment_filename}"',
-            )
-            msg.attach(part)
-            log.info(f"Attached file: {capsule.attachment_filename}")
-        except Exception as e:
-            log.error(f"Error attaching file {capsule.attachment_filename}: {e}")
-            # Decide how to handle attachment errors - skip sending, send without attachment, etc.
-            # For now, we'll raise the exception to fail the send for this capsule.
-            raise
-
+    # Attach file if exists (stat is the existence check)
+    attachment_path = attachment_full_path(capsule.attachment_path)
     try:
-        # Use a context manager for the SMTP server
-        with smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT']) as server:
-            server.ehlo() # Can be omitted
-            if app.config['MAIL_USE_TLS']:
-                 server.starttls() # Secure the connection
-                 server.ehlo() # Can be omitted
+        part = MIMEBase('application', 'octet-stream')
+        st = os.stat(attachment_path)
+        if st.st_size > ATTACHMENT_STREAM_THRESHOLD:
+            # Large files are streamed by send_message, only mark where the payload goes
+            part.set_payload(ATTACHMENT_PLACEHOLDER)
+            msg.streamed_attachment_path = attachment_path
+        else:
+            part.set_payload(encoded_attachment(attachment_path, st.st_mtime_ns, st.st_size))
+        part['Content-Transfer-Encoding'] = 'base64'
+        # Use the original filename for the attachment in the email
+        part.add_header(
+            'Content-Disposition',
+            f'attachment; filename="{capsule.attachment_filename}"',
+        )
+        msg.attach(part)
+        log.info(f"Attached file: {capsule.attachment_filename}")
+    except FileNotFoundError:
+        # Don't deliver a capsule without the file it promised; mark it failed instead
+        log.error(f"Attachment file not found: {attachment_path}")
+        raise FileNotFoundError(f"Attachment file not found: {capsule.attachment_filename}") from None
+    except Exception as e:
+        log.error(f"Error attaching file {capsule.attachment_filename}: {e}")
+        # Decide how to handle attachment errors - skip sending, send without attachment, etc.
+        # For now, we'll raise the exception to fail the send for this capsule.
+        raise
 
-            if app.config['MAIL_USE_SSL']:
-                 # If using SSL, need a different server object
-                 server = smtplib.SMTP_SSL(app.config['MAIL_SERVER'], app.config['MAIL_PORT'])
+    return msg
 
 
-            server.login(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-            text = msg.as_string()
-            server.sendmail(app.config['MAIL_DEFAULT_SENDER'], capsule.recipient_email, text)
-            # server.quit() # Not needed with context manager
+@functools.lru_cache(maxsize=ATTACHMENT_CACHE_SIZE)
+def encoded_attachment(attachment_path, mtime_ns, size):
+    """
+    Returns the base64 payload of a small attachment. Cached by path, mtime and size,
+    so a capsule retried on later runs doesn't re-read and re-encode an unchanged file.
+    """
+    with open(attachment_path, 'rb') as f:
+        return base64.encodebytes(f.read()).decode('ascii')
 
+
+def send_message(server, capsule, msg):
+    """
+    Sends a built message for a capsule over an already open SMTP connection.
+    """
+    try:
+        if getattr(msg, 'streamed_attachment_path', None):
+            stream_message(server, capsule, msg)
+        else:
+            server.send_message(msg, SMTP_CONFIG.sender, [capsule.recipient_email])
         log.info("Email sent successfully!")
+    except smtplib.SMTPServerDisconnected:
+        raise # Let the batch loop reconnect
     except Exception as e:
         log.error(f"SMTP error occurred: {e}")
         raise # Re-raise the exception to be caught by the scheduler job
 
+
+def stream_message(server, capsule, msg):
+    """
+    Sends a message whose attachment is too large to buffer.
+    Runs the MAIL/RCPT/DATA exchange by hand and base64-encodes the attachment
+    straight from a memory map of the file onto the socket, so the file is never
+    copied into a Python bytes object; only one encoded chunk is held at a time.
+    """
+    sender = SMTP_CONFIG.sender
+    head, tail = msg.as_bytes(policy=email_policy.SMTP).split(ATTACHMENT_PLACEHOLDER.encode(), 1)
+    # Each encoded chunk already ends with CRLF, which doubles as the one before the closing boundary
+    if tail.startswith(b'\r\n'):
+        tail = tail[2:]
+
+    # Opened before MAIL FROM, so a missing or unreadable file fails the capsule without leaving the
+    # server waiting mid-transaction
+    with open(msg.streamed_attachment_path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+            memoryview(mapped) as view: # Released before the map is closed
+        server.ehlo_or_helo_if_needed()
+        code, resp = server.mail(sender)
+        if code != 250:
+            server.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, sender)
+        code, resp = server.rcpt(capsule.recipient_email)
+        if code not in (250, 251):
+            server.rset()
+            raise smtplib.SMTPRecipientsRefused({capsule.recipient_email: (code, resp)})
+        code, resp = server.docmd('data')
+        if code != 354:
+            server.rset()
+            raise smtplib.SMTPDataError(code, resp)
+
+        try:
+            # Lines starting with '.' must be doubled inside DATA; base64 lines never start with one
+            server.send(re.sub(rb'(?m)^\.', b'..', head))
+            for offset in range(0, len(view), ATTACHMENT_CHUNK_SIZE):
+                with view[offset:offset + ATTACHMENT_CHUNK_SIZE] as chunk: # A view, not a copy
+                    server.send(base64.encodebytes(chunk).replace(b'\n', b'\r\n'))
+            server.send(re.sub(rb'(?m)^\.', b'..', tail) + b'.\r\n')
+            code, resp = server.getreply()
+        except Exception as e:
+            # The server is still reading message data and would take any further command as part
+            # of it, so drop the connection and let the caller reconnect
+            server.close()
+            raise smtplib.SMTPServerDisconnected(f"Connection lost while sending message data: {e}") from e
+
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+
+# --- Capsule Helpers ---
+def parse_send_datetime(send_datetime_str, now_utc):
+    """
+    Parses the send_datetime string sent by the client into naive UTC.
+    The string must be ISO 8601 with a 'Z' or +HH:MM offset; raises ValueError for
+    invalid input, including datetimes without an offset.
+    now_utc is the request's naive UTC time, used for the future-date check.
+    """
+    if ciso8601 is not None:
+        send_datetime = ciso8601.parse_datetime(send_datetime_str)
+    else:
+        # fromisoformat only accepts the 'Z' suffix the frontend's toISOString() produces from Python 3.11
+        send_datetime = datetime.fromisoformat(send_datetime_str.replace('Z', '+00:00'))
+    log.info(f"Received send_datetime_str: {send_datetime_str}")
+
+    # Naive values are ambiguous (whose local time?), so they are rejected rather than guessed at
+    if send_datetime.utcoffset() is None:
+        raise ValueError('send_datetime must include a timezone offset')
+    send_datetime_utc = send_datetime.astimezone(timezone.utc).replace(tzinfo=None)
+    log.info(f"Parsed send_datetime as UTC: {send_datetime_utc}")
+
+    # Check if date is in the future (using the correctly converted UTC time)
+    log.info(f"Current UTC time: {now_utc}")
+    # This check is primarily for immediate feedback in the API response
+    # The scheduler's comparison is the final authority for sending
+    if send_datetime_utc <= now_utc:
+         log.warning("Received a send date that is not in the future (based on server's interpretation).")
+         # You might want to return an error here for better UX feedback:
+         # return jsonify({'detail': 'Sending date must be in the future.'}), 400
+
+    return send_datetime_utc
+
+
+def unique_upload_name(filename):
+    """
+    Secures an uploaded filename and returns (original_filename, unique_filename),
+    where unique_filename is the name to store it under in UPLOAD_FOLDER.
+    """
+    # Secure the filename and generate a unique name to prevent conflicts
+    original_filename = secure_filename(filename)
+    unique_filename = f'{secrets.token_urlsafe(16)}_{original_filename}' # 128 random bits, 22 characters
+    return original_filename, unique_filename
+
+
+def attachment_full_path(attachment_path):
+    """
+    Returns the full path of a stored attachment_path.
+    Older rows hold an absolute path, which os.path.join leaves unchanged.
+    """
+    return os.path.join(ABS_UPLOAD_FOLDER, attachment_path)
+
+
+def save_upload(stream, file_path, chunk_size=UPLOAD_COPY_BUFFER):
+    """
+    Copies an uploaded file stream to file_path.
+    The data is written under a temporary name and renamed into place, so a partial
+    file is never visible at file_path. Uploads Werkzeug already spooled to a temporary
+    file are copied with os.sendfile on Linux.
+    """
+    tmp_path = file_path + '.part'
+    try:
+        try:
+            src_fd = stream.fileno()
+        except (AttributeError, io.UnsupportedOperation, OSError):
+            src_fd = None # In-memory upload (BytesIO) or a network stream
+
+        with open(tmp_path, 'wb') as dst:
+            # Only Linux can sendfile between regular files; macOS and the BSDs need a socket as the target
+            if src_fd is not None and sys.platform.startswith('linux'):
+                # Zero-copy: let the kernel move the bytes from the spooled upload
+                remaining = os.fstat(src_fd).st_size
+                offset = 0
+                while remaining > 0:
+                    sent = os.sendfile(dst.fileno(), src_fd, offset, remaining)
+                    if sent == 0:
+                        break
+                    offset += sent
+                    remaining -= sent
+            else:
+                shutil.copyfileobj(stream, dst, chunk_size)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        # Don't leave a partial file behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def remove_attachment(attachment_path):
+    """
+    Deletes a stored attachment file. Failures are logged, not raised,
+    since the capsule row is already gone by the time this runs.
+    """
+    file_path = attachment_full_path(attachment_path)
+    try:
+        os.remove(file_path)
+        log.info(f"Deleted attachment file: {file_path}")
+    except FileNotFoundError:
+        pass # Already gone, or still staged (the upload worker removes it then)
+    except Exception as e:
+        log.warning(f"Warning: Failed to delete attachment file {file_path}: {e}")
+
+
+def staging_path(attachment_path):
+    """
+    Returns where an upload for attachment_path is written before it is moved into place.
+    """
+    return os.path.join(UPLOAD_STAGING_FOLDER, os.path.basename(attachment_path))
+
+
+def add_capsule(recipient_email, subject, body, send_datetime_utc, attachment_path, attachment_filename, status='pending', created_at=None):
+    """
+    Creates a capsule (pending unless another status is given) and commits it.
+    created_at defaults to the current UTC time.
+    """
+    # Create new capsule instance
+    new_capsule = Capsule(
+        recipient_email=recipient_email,
+        subject=subject,
+        body=body,
+        send_datetime_utc=send_datetime_utc,
+        attachment_path=attachment_path,
+        attachment_filename=attachment_filename,
+        status=status,
+        error_message=None, # Initialize error message as None
+        created_at=created_at or utc_now_naive(),
+    )
+
+    # Add to database and commit
+    db.session.add(new_capsule)
+    db.session.commit()
+    log.info(f"Capsule created with ID: {new_capsule.id}, Stored UTC: {new_capsule.send_datetime_utc.isoformat()}")
+    wake_scheduler(new_capsule.send_datetime_utc)
+    return new_capsule
+
+def create_capsule_response(recipient_email, subject, body, send_datetime_utc, created_at,
+                            attachment_path=None, attachment_filename=None, staged_path=None):
+    """
+    Adds a capsule for the create endpoints and returns their response. A capsule with an
+    attachment stays 'uploading' (202) until the upload worker has moved staged_path into place;
+    one without is created pending (201).
+    """
+    if attachment_path:
+        new_capsule = add_capsule(recipient_email, subject, body, send_datetime_utc, attachment_path, attachment_filename, status='uploading', created_at=created_at)
+        queue_upload(new_capsule.id, staged_path, attachment_path)
+        return jsonify(new_capsule.to_dict()), 202 # 202 Accepted
+
+    new_capsule = add_capsule(recipient_email, subject, body, send_datetime_utc, None, None, created_at=created_at)
+    return jsonify(new_capsule.to_dict()), 201 # 201 Created
+
+
+def invalid_send_datetime(send_datetime_str, error):
+    """
+    Returns the 400 response for a send_datetime that parse_send_datetime() rejected.
+    """
+    log.error(f"ValueError parsing send_datetime: {send_datetime_str}. Error: {error}")
+    return jsonify({'detail': f'Invalid send_datetime format: {send_datetime_str}. Expected an ISO 8601 string with a timezone offset, e.g. 2030-01-01T09:00:00Z.'}), 400
+
+# --- Background Upload Worker ---
+upload_queue = queue.Queue() # (capsule_id, staged_path, attachment_path) for uploads waiting to be moved into place
+upload_worker_pid = None # Process the upload worker thread was started in
+upload_worker_lock = threading.Lock()
+# The scheduler re-queues uploads still 'uploading' this long after the capsule was created
+UPLOAD_REQUEUE_AGE = 5 * 60
+UPLOAD_REQUEUE_INTERVAL = 5 * 60
+
+def queue_upload(capsule_id, staged_path, attachment_path):
+    """
+    Hands a staged upload to this process's upload worker, starting the worker first if needed.
+    It is started lazily, per process: threads don't survive a fork, so one started at import
+    would be missing in workers forked after it (gunicorn --preload).
+    """
+    global upload_queue, upload_worker_pid
+    with upload_worker_lock:
+        if upload_worker_pid != os.getpid():
+            upload_queue = queue.Queue() # Anything in an inherited queue belongs to the parent's worker
+            threading.Thread(target=finalize_uploads, args=(upload_queue,), name='upload-worker', daemon=True).start()
+            upload_worker_pid = os.getpid()
+        upload_queue.put((capsule_id, staged_path, attachment_path))
+
+
+def reset_upload_worker():
+    """
+    Runs in a forked child: a lock some other thread held at fork time would never be released there.
+    """
+    global upload_worker_lock
+    upload_worker_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=reset_upload_worker)
+
+
+def finalize_uploads(uploads):
+    """
+    Upload worker thread. Moves staged attachments from the uploads queue into UPLOAD_FOLDER
+    and marks their capsules pending, so requests don't wait on it.
+    """
+    while True:
+        capsule_id, staged_path, attachment_path = uploads.get()
+        try:
+            finalize_upload(capsule_id, staged_path, attachment_path)
+        except Exception as e:
+            log.error(f"Unexpected error finalizing upload for capsule ID {capsule_id}: {e}")
+        finally:
+            uploads.task_done()
+
+
+def finalize_upload(capsule_id, staged_path, attachment_path):
+    """
+    Moves one staged attachment into UPLOAD_FOLDER and flips its capsule from 'uploading' to 'pending'.
+    """
+    file_path = attachment_full_path(attachment_path)
+    with app.app_context():
+        moved = False # Whether this call put the file in place, and so owns it
+        try:
+            try:
+                shutil.move(staged_path, file_path) # A plain rename when staging is on the same filesystem
+                moved = True
+            except FileNotFoundError:
+                # A re-queued upload may already have been moved by another finalize of the same capsule
+                if not os.path.exists(file_path):
+                    raise FileNotFoundError(f"Staged attachment not found: {staged_path}") from None
+        except Exception as e:
+            log.error(f"Failed to move attachment for capsule ID {capsule_id}: {e}")
+            db.session.execute(update(Capsule).where(Capsule.id == capsule_id, Capsule.status == 'uploading')
+                               .values(status='failed', error_message=f'Failed to store attachment: {e}'))
+            db.session.commit()
+            return
+
+        result = db.session.execute(update(Capsule).where(Capsule.id == capsule_id, Capsule.status == 'uploading')
+                                    .values(status='pending'))
+        db.session.commit()
+        if result.rowcount == 0:
+            # Capsule was deleted while its upload was queued; don't leave the file behind. If another
+            # finalize already moved it, the capsule may now be pending with this file, so leave it alone
+            if moved:
+                log.info(f"Capsule ID {capsule_id} no longer waiting for its upload. Removing {file_path}")
+                os.remove(file_path)
+        else:
+            log.info(f"Attachment for capsule ID {capsule_id} moved into place: {file_path}")
+
+
+def requeue_staged_uploads(min_age=None):
+    """
+    Queues capsules left in 'uploading', whose upload a process lost (it stopped, or was forked
+    without a worker) before moving the file. Run by the process holding the scheduler lock: at
+    startup for all of them, then periodically for ones older than min_age seconds whose staged
+    file is still there.
+    """
+    try:
+        with app.app_context():
+            query = db.session.query(Capsule.id, Capsule.attachment_path).filter(Capsule.status == 'uploading')
+            if min_age is not None:
+                query = query.filter(Capsule.created_at < utc_now_naive() - timedelta(seconds=min_age))
+            stuck = query.all()
+    except Exception as e:
+        log.error(f"Could not check for unfinished uploads: {e}")
+        return
+    if min_age is not None:
+        stuck = [(capsule_id, attachment_path) for capsule_id, attachment_path in stuck
+                 if os.path.exists(staging_path(attachment_path))]
+    for capsule_id, attachment_path in stuck:
+        queue_upload(capsule_id, staging_path(attachment_path), attachment_path)
+    if stuck:
+        log.info(f"Re-queued {len(stuck)} unfinished uploads.")
+
 # --- API Endpoints ---
 
 @app.route('/api/capsules', methods=['POST'])
@@ -239,48 +1113,13 @@ def create_capsule():
             log.warning("Missing required fields in capsule creation.")
             return jsonify({'detail': 'Missing required fields'}), 400
 
+        now_utc = utc_now_naive() # Taken once, for the future-date check and created_at
+
         # Validate and parse send_datetime
         try:
-            # Attempt to parse the datetime string.
-            # datetime.fromisoformat can handle YYYY-MM-DDTHH:mm, YYYY-MM-DDTHH:mm:ss,
-            # YYYY-MM-DDTHH:mm:ss.ffffff, and versions with timezone info (+HH:MM or Z).
-            # The error suggests the frontend is sending YYYY-MM-DDTHH:mm:ss.ffffffZ
-            send_datetime_local = datetime.fromisoformat(send_datetime_str)
-            log.info(f"Received send_datetime_str: {send_datetime_str}")
-            log.info(f"Parsed send_datetime_local (before timezone): {send_datetime_local}")
-
-            # If the parsed datetime is timezone-aware (due to 'Z' or offset), convert it directly to UTC
-            if send_datetime_local.tzinfo is not None and send_datetime_local.tzinfo.utcoffset(send_datetime_local) is not None:
-                 send_datetime_utc = send_datetime_local.astimezone(timezone.utc)
-                 log.info(f"Parsed datetime was timezone-aware. Converted to UTC: {send_datetime_utc}")
-            else:
-                # If the parsed datetime is naive, assume it's in the LOCAL_TIMEZONE
-                local_timezone_name = app.config.get('LOCAL_TIMEZONE', 'UTC')
-                try:
-                     local_timezone = pytz.timezone(local_timezone_name)
-                except pytz.UnknownTimeZoneError:
-                     log.warning(f"Unknown timezone '{local_timezone_name}'. Defaulting to UTC for naive datetime.")
-                     local_timezone = pytz.timezone('UTC')
-
-                send_datetime_aware_local = local_timezone.localize(send_datetime_local)
-                send_datetime_utc = send_datetime_aware_local.astimezone(timezone.utc)
-                log.info(f"Parsed datetime was naive. Assumed local timezone: {local_timezone_name}. Converted to UTC: {send_datetime_utc}")
-
-
-            # Check if date is in the future (using the correctly converted UTC time)
-            now_utc = datetime.now(timezone.utc) # Use timezone-aware datetime
-            log.info(f"Current UTC time: {now_utc}")
-            # This check is primarily for immediate feedback in the API response
-            # The scheduler's comparison is the final authority for sending
-            if send_datetime_utc <= now_utc:
-                 log.warning("Received a send date that is not in the future (based on server's interpretation).")
-                 # You might want to return an error here for better UX feedback:
-                 # return jsonify({'detail': 'Sending date must be in the future.'}), 400
-
-
+            send_datetime_utc = parse_send_datetime(send_datetime_str, now_utc)
         except ValueError as e:
-            log.error(f"ValueError parsing send_datetime: {send_datetime_str}. Error: {e}")
-            return jsonify({'detail': f'Invalid send_datetime format: {send_datetime_str}. Expected YYYY-MM-DDTHH:mm or a valid ISO 8601 string.'}), 400
+            return invalid_send_datetime(send_datetime_str, e)
         except Exception as e:
             log.error(f"An unexpected error occurred during date parsing: {e}")
             return jsonify({'detail': f'An internal error occurred during date processing: {e}'}), 500
@@ -288,6 +1127,7 @@ def create_capsule():
 
         attachment_path = None
         attachment_filename = None
+        staged_path = None
 
         # Handle file upload
         if attachment_file:
@@ -295,16 +1135,14 @@ def create_capsule():
                 log.warning("No selected file for attachment.")
                 return jsonify({'detail': 'No selected file for attachment'}), 400
 
-            # Secure the filename and generate a unique name to prevent conflicts
-            original_filename = secure_filename(attachment_file.filename)
-            unique_filename = str(uuid.uuid4()) + '_' + original_filename
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+            original_filename, unique_filename = unique_upload_name(attachment_file.filename)
+            staged_path = staging_path(unique_filename)
 
             try:
-                attachment_file.save(file_path)
-                attachment_path = file_path
+                save_upload(attachment_file.stream, staged_path)
+                attachment_path = unique_filename # Name inside UPLOAD_FOLDER; the upload worker moves the file there
                 attachment_filename = original_filename # Store original name for email
-                log.info(f"File saved successfully: {file_path}")
+                log.info(f"File saved successfully: {staged_path}")
             except Exception as e:
                 log.error(f"Error saving file: {e}")
                 return jsonify({'detail': f'Failed to save attachment: {e}'}), 500
@@ -331,24 +1169,8 @@ def create_capsule():
             # ------------------------------------
 
 
-        # Create new capsule instance
-        new_capsule = Capsule(
-            recipient_email=recipient_email,
-            subject=subject,
-            body=body,
-            send_datetime_utc=send_datetime_utc,
-            attachment_path=attachment_path,
-            attachment_filename=attachment_filename,
-            status='pending',
-            error_message=None # Initialize error message as None
-        )
-
-        # Add to database and commit
-        db.session.add(new_capsule)
-        db.session.commit()
-        log.info(f"Capsule created with ID: {new_capsule.id}, Stored UTC: {new_capsule.send_datetime_utc.isoformat()}")
-
-        return jsonify(new_capsule.to_dict()), 201 # 201 Created
+        return create_capsule_response(recipient_email, subject, body, send_datetime_utc, now_utc,
+                                       attachment_path, attachment_filename, staged_path)
 
     except Exception as e:
         db.session.rollback() # Rollback changes in case of error
@@ -356,56 +1178,196 @@ def create_capsule():
         # Return a generic error message for unexpected errors
         return jsonify({'detail': f'An internal error occurred: {e}'}), 500
 
+# Loader options for endpoints that load Capsule objects. raiseload('*') makes any relationship
+# added to Capsule later raise on lazy access (e.g. from to_dict) instead of silently issuing a
+# query per row; endpoints that need one should eager-load it with selectinload() instead.
+CAPSULE_LOAD_OPTIONS = (raiseload('*'),)
+
+# Columns returned by the capsule list; body and error_message are only added on request
+CAPSULE_LIST_COLUMNS = (
+    Capsule.id,
+    Capsule.recipient_email,
+    Capsule.subject,
+    Capsule.send_datetime_utc.label('send_datetime'),
+    Capsule.attachment_filename,
+    Capsule.status,
+    Capsule.created_at,
+)
+CAPSULE_OPTIONAL_COLUMNS = {
+    'body': Capsule.body,
+    'error_message': Capsule.error_message,
+}
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+@app.route('/api/capsules/stream', methods=['POST'])
+def create_capsule_stream():
+    """
+    Creates a new time capsule from a raw (non-multipart) upload.
+    Expects recipient_email, subject, body, send_datetime and, if the request body is an attachment,
+    filename in the query string. The request body is written straight to disk in chunks,
+    skipping the multipart parser and its in-memory/temporary-file copy.
+    """
+    try:
+        recipient_email = request.args.get('recipient_email')
+        subject = request.args.get('subject')
+        body = request.args.get('body')
+        send_datetime_str = request.args.get('send_datetime')
+        filename = request.args.get('filename')
+
+        # Basic validation
+        if not recipient_email or not subject or not body or not send_datetime_str:
+            log.warning("Missing required fields in streamed capsule creation.")
+            return jsonify({'detail': 'Missing required fields'}), 400
+
+        now_utc = utc_now_naive() # Taken once, for the future-date check and created_at
+
+        # Validate and parse send_datetime
+        try:
+            send_datetime_utc = parse_send_datetime(send_datetime_str, now_utc)
+        except ValueError as e:
+            return invalid_send_datetime(send_datetime_str, e)
+
+        attachment_path = None
+        attachment_filename = None
+        staged_path = None
+
+        # The request body is the attachment, if a filename was given
+        if filename:
+            original_filename, unique_filename = unique_upload_name(filename)
+            if not original_filename:
+                log.warning(f"Unusable attachment filename: {filename}")
+                return jsonify({'detail': 'Invalid attachment filename'}), 400
+            staged_path = staging_path(unique_filename)
+
+            try:
+                # request.stream enforces MAX_CONTENT_LENGTH while reading
+                save_upload(request.stream, staged_path, UPLOAD_CHUNK_SIZE)
+                attachment_path = unique_filename # Name inside UPLOAD_FOLDER; the upload worker moves the file there
+                attachment_filename = original_filename # Store original name for email
+                log.info(f"File streamed successfully: {staged_path}")
+            except RequestEntityTooLarge:
+                log.warning("Streamed attachment exceeds MAX_CONTENT_LENGTH.")
+                return jsonify({'detail': 'Attachment is too large'}), 413
+            except Exception as e:
+                log.error(f"Error streaming file: {e}")
+                return jsonify({'detail': f'Failed to save attachment: {e}'}), 500
+
+        return create_capsule_response(recipient_email, subject, body, send_datetime_utc, now_utc,
+                                       attachment_path, attachment_filename, staged_path)
+
+    except Exception as e:
+        db.session.rollback() # Rollback changes in case of error
+        log.error(f"Error creating streamed capsule: {e}")
+        return jsonify({'detail': f'An internal error occurred: {e}'}), 500
+
 @app.route('/api/capsules', methods=['GET'])
 def get_capsules():
     """
-    Retrieves all time capsules.
+    Retrieves a page of time capsules, most recently created first, as {items, next_cursor}.
+    Pass next_cursor back as cursor for the following page; it is null on the last page.
+    GET /api/capsules/<id> returns a single capsule in full.
+    Optional query params: limit, cursor, status, and include (comma separated: body, error_message).
     """
     try:
-        capsules = Capsule.query.all()
-        # Convert list of Capsule objects to list of dictionaries
-        return jsonify([capsule.to_dict() for capsule in capsules]), 200
+        limit = min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+    except ValueError:
+        log.warning("Invalid limit in capsule list request.")
+        return jsonify({'detail': 'limit must be an integer'}), 400
+    if limit < 0:
+        return jsonify({'detail': 'limit must not be negative'}), 400
+    if 'offset' in request.args:
+        # Replaced by cursor; ignoring it would hand an offset-paging client the first page forever
+        return jsonify({'detail': 'offset is not supported; pass the previous page\'s next_cursor as cursor'}), 400
+    cursor = request.args.get('cursor')
+    if cursor:
+        # '<created_at>,<id>' of the last capsule on the previous page
+        try:
+            cursor_created, _, cursor_id = cursor.rpartition(',')
+            cursor_created, cursor_id = datetime.fromisoformat(cursor_created), int(cursor_id)
+        except ValueError:
+            log.warning(f"Invalid cursor in capsule list request: {cursor}")
+            return jsonify({'detail': 'Invalid cursor'}), 400
+
+    include = [name for name in request.args.get('include', '').split(',') if name]
+    unknown = [name for name in include if name not in CAPSULE_OPTIONAL_COLUMNS]
+    if unknown:
+        return jsonify({'detail': f'Unknown include field(s): {", ".join(unknown)}'}), 400
+
+    try:
+        columns = CAPSULE_LIST_COLUMNS + tuple(CAPSULE_OPTIONAL_COLUMNS[name] for name in include)
+        stmt = select(*columns)
+        status = request.args.get('status')
+        if status:
+            stmt = stmt.where(Capsule.status == status)
+        if cursor:
+            # Keyset rather than OFFSET: pages stay put when capsules are created, and later
+            # pages don't have to scan past the earlier ones
+            stmt = stmt.where(tuple_(Capsule.created_at, Capsule.id) < tuple_(cursor_created, cursor_id))
+        # ix_capsule_created_at turns ORDER BY + LIMIT into an index scan
+        stmt = stmt.order_by(Capsule.created_at.desc(), Capsule.id.desc()).limit(limit)
+        # Plain rows skip ORM object hydration; datetimes are serialized by the JSON provider.
+        # The keys are worked out once per request rather than per row by row._asdict(),
+        # and rows go straight from the cursor into the dicts without an intermediate list
+        keys = tuple(column.key for column in columns)
+        items = [dict(zip(keys, row)) for row in db.session.execute(stmt)]
+        last = items[-1] if limit and len(items) == limit else None
+        return jsonify({
+            'items': items,
+            'next_cursor': f"{last['created_at'].isoformat()},{last['id']}" if last else None,
+        }), 200
     except Exception as e:
         log.error(f"Error fetching capsules: {e}")
         return jsonify({'detail': 'Failed to retrieve capsules.'}), 500
 
+@app.route('/api/capsules/<int:capsule_id>', methods=['GET'])
+def get_capsule(capsule_id):
+    """
+    Retrieves a single time capsule by ID, including its body and error message.
+    """
+    try:
+        capsule = db.session.get(Capsule, capsule_id, options=CAPSULE_LOAD_OPTIONS)
+    except Exception as e:
+        log.error(f"Error fetching capsule {capsule_id}: {e}")
+        return jsonify({'detail': 'Failed to retrieve capsule.'}), 500
+    if capsule is None:
+        log.warning(f"Request for non-existent capsule ID: {capsule_id}")
+        return jsonify({'detail': 'Capsule not found'}), 404
+    return jsonify(capsule.to_dict()), 200
+
 @app.route('/api/capsules/<int:capsule_id>', methods=['DELETE'])
 def delete_capsule(capsule_id):
     """
     Deletes a specific time capsule by ID.
     """
     try:
-        capsule = Capsule.query.get(capsule_id)
-        if capsule is None:
+        # One DELETE ... RETURNING instead of a SELECT followed by a DELETE
+        row = db.session.execute(
+            delete(Capsule).where(Capsule.id == capsule_id).returning(Capsule.attachment_path)
+        ).first()
+        if row is None:
+            db.session.rollback()
             log.warning(f"Delete request for non-existent capsule ID: {capsule_id}")
             return jsonify({'detail': 'Capsule not found'}), 404
+        db.session.commit()
+        log.info(f"Deleted capsule ID: {capsule_id}")
 
-        # If using local storage, delete the associated file
-        if capsule.attachment_path and os.path.exists(capsule.attachment_path):
-            try:
-                os.remove(capsule.attachment_path)
-                log.info(f"Deleted attachment file: {capsule.attachment_path}")
-            except Exception as e:
-                log.warning(f"Warning: Failed to delete attachment file {capsule.attachment_path}: {e}")
-                # Continue with deleting the database record even if file deletion fails
+        # If using local storage, delete the associated file once the row is gone
+        if row.attachment_path:
+            remove_attachment(row.attachment_path)
 
         # --- Firebase/S3 Integration Note ---
         # If using cloud storage, delete the file from the cloud storage bucket here.
         # Example (pseudo-code for Firebase):
         # try:
         #     bucket = storage.bucket()
-        #     blob = bucket.blob(f'attachments/{os.path.basename(capsule.attachment_path)}') # Assuming path stores filename
+        #     blob = bucket.blob(f'attachments/{os.path.basename(row.attachment_path)}') # Assuming path stores filename
         #     blob.delete()
-        #     print(f"Deleted attachment from Firebase: {capsule.attachment_path}")
+        #     print(f"Deleted attachment from Firebase: {row.attachment_path}")
         # except Exception as e:
-        #      print(f"Warning: Failed to delete attachment from Firebase {capsule.attachment_path}: {e}")
+        #      print(f"Warning: Failed to delete attachment from Firebase {row.attachment_path}: {e}")
         # ------------------------------------
 
-
-        db.session.delete(capsule)
-        db.session.commit()
-        log.info(f"Deleted capsule ID: {capsule_id}")
-
         return jsonify({'message': 'Capsule deleted successfully'}), 200
 
     except Exception as e:
@@ -413,6 +1375,38 @@ def delete_capsule(capsule_id):
         log.error(f"Error deleting capsule {capsule_id}: {e}")
         return jsonify({'detail': 'Failed to delete capsule.'}), 500
 
+@app.route('/api/capsules/delete', methods=['POST'])
+def delete_capsules():
+    """
+    Deletes several time capsules at once.
+    Expects a JSON body with: ids (a list of capsule IDs). Unknown IDs are ignored.
+    """
+    data = request.get_json(silent=True)
+    capsule_ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(capsule_ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in capsule_ids):
+        log.warning("Bulk delete request without a list of integer ids.")
+        return jsonify({'detail': 'ids must be a list of integers'}), 400
+    if not capsule_ids:
+        return jsonify({'deleted': []}), 200
+
+    try:
+        rows = db.session.execute(
+            delete(Capsule).where(Capsule.id.in_(capsule_ids)).returning(Capsule.id, Capsule.attachment_path)
+        ).all()
+        db.session.commit()
+        log.info(f"Deleted {len(rows)} capsules in bulk.")
+
+        for row in rows:
+            if row.attachment_path:
+                remove_attachment(row.attachment_path)
+
+        return jsonify({'deleted': [row.id for row in rows]}), 200
+
+    except Exception as e:
+        db.session.rollback() # Rollback changes in case of error
+        log.error(f"Error deleting capsules {capsule_ids}: {e}")
+        return jsonify({'detail': 'Failed to delete capsules.'}), 500
+
 # --- Endpoint to Serve Attachments ---
 @app.route('/api/capsules/<int:capsule_id>/attachment', methods=['GET'])
 def download_attachment(capsule_id):
@@ -421,7 +1415,7 @@ def download_attachment(capsule_id):
     """
     log.info(f"Attempting to serve attachment for capsule ID: {capsule_id}")
     try:
-        capsule = Capsule.query.get(capsule_id)
+        capsule = db.session.get(Capsule, capsule_id, options=CAPSULE_LOAD_OPTIONS)
         if capsule is None:
             log.warning(f"Attachment download: Capsule ID {capsule_id} not found.")
             abort(404, description="Capsule not found")
@@ -433,40 +1427,49 @@ def download_attachment(capsule_id):
              log.warning(f"Attachment download: Capsule ID {capsule_id} has no attachment_path stored.")
              abort(404, description="Attachment not found for this capsule")
 
-        # Check if the file actually exists on the filesystem
-        if not os.path.exists(capsule.attachment_path):
-             log.warning(f"Attachment download: Attachment file not found on disk at path: {capsule.attachment_path}")
-             abort(404, description="Attachment file not found")
-
-
-        # Ensure the file is within the configured upload folder for security
+        # Resolve symlinks and '..' once, then make sure the file is inside the upload folder
         # This prevents directory traversal attacks
-        # Get the absolute path of the stored file
-        abs_attachment_path = os.path.abspath(capsule.attachment_path)
-        # Get the absolute path of the upload folder
-        abs_upload_folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
-
-        log.info(f"Attachment download: Absolute attachment path: {abs_attachment_path}")
-        log.info(f"Attachment download: Absolute upload folder: {abs_upload_folder}")
+        resolved_path = os.path.realpath(attachment_full_path(capsule.attachment_path))
+        log.info(f"Attachment download: Resolved attachment path: {resolved_path}")
 
-        if not abs_attachment_path.startswith(abs_upload_folder):
+        if os.path.commonpath([resolved_path, ABS_UPLOAD_FOLDER]) != ABS_UPLOAD_FOLDER:
             log.error(f"Security Warning: Attempted to access file outside upload folder: {capsule.attachment_path}")
             abort(403, description="Cannot access this file") # Forbidden
 
-        # Use send_from_directory to serve the file
-        # directory is the folder containing the file
-        # path is the filename relative to the directory
-        directory = os.path.dirname(abs_attachment_path) # Use absolute path for directory
-        filename = os.path.basename(abs_attachment_path) # Use absolute path for filename
-
-        log.info(f"Attachment download: Serving file from directory: {directory}")
+        # Path relative to the upload folder, which send_from_directory serves from
+        filename = os.path.relpath(resolved_path, ABS_UPLOAD_FOLDER)
         log.info(f"Attachment download: Serving filename: {filename}")
         log.info(f"Attachment download: Download name: {capsule.attachment_filename}")
 
+        if app.config['ATTACHMENT_ACCEL_PREFIX']:
+            # Hand the file off to nginx, which serves it from its internal location
+            accel_path = app.config['ATTACHMENT_ACCEL_PREFIX'].rstrip('/') + '/' + quote(filename)
+            log.info(f"Attachment download: Redirecting internally to: {accel_path}")
+            response = app.response_class(mimetype=mimetypes.guess_type(capsule.attachment_filename or filename)[0] or 'application/octet-stream')
+            response.headers['X-Accel-Redirect'] = accel_path
+            response.headers.set('Content-Disposition', 'attachment', filename=capsule.attachment_filename or filename)
+            # nginx keeps Cache-Control from this response and handles ETag/Range for the file itself
+            response.cache_control.private = True
+            response.cache_control.max_age = app.config['ATTACHMENT_MAX_AGE']
+            return response
 
         # Use the original filename for the download
-        return send_from_directory(directory, filename, as_attachment=True, download_name=capsule.attachment_filename)
-
+        # send_from_directory checks the file exists itself, so there is no separate check here.
+        # conditional=True sets ETag/Last-Modified from the file's stat, answers If-None-Match and
+        # If-Modified-Since with 304 and serves Range requests (using wsgi.file_wrapper where available)
+        try:
+            response = send_from_directory(ABS_UPLOAD_FOLDER, filename, as_attachment=True, download_name=capsule.attachment_filename,
+                                           conditional=True, etag=True, max_age=app.config['ATTACHMENT_MAX_AGE'])
+        except NotFound:
+            log.warning(f"Attachment download: Attachment file not found on disk at path: {resolved_path}")
+            abort(404, description="Attachment file not found")
+        # Attachments belong to one capsule, so only the browser may cache them, not shared caches
+        response.cache_control.public = False
+        response.cache_control.private = True
+        return response
+
+    except HTTPException:
+        raise # Keep the 403/404s raised above instead of turning them into 500s
     except Exception as e:
         log.error(f"An unexpected error occurred while serving attachment for capsule {capsule_id}: {e}")
         # Use error.description if it's an HTTPException, otherwise provide a generic message
@@ -494,15 +1497,54 @@ def internal_error(error):
 
 # --- Setup and Running ---
 
+scheduler_lock = None # Held open for the life of the process; the OS releases it when the process exits
+
+def acquire_scheduler_lock():
+    """
+    Tries to take an exclusive, non-blocking lock on SCHEDULER_LOCK_FILE.
+    Returns True if this process should run the scheduler.
+    """
+    global scheduler_lock
+    if fcntl is None:
+        log.warning("fcntl not available. Starting scheduler without a cross-process lock.")
+        return True
+    lock_file = open(SCHEDULER_LOCK_FILE, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    scheduler_lock = lock_file
+    return True
+
+def recover_claimed_capsules():
+    """
+    Releases capsules a previous scheduler process left in 'sending'.
+    """
+    try:
+        with app.app_context():
+            release_claimed_capsules()
+    except Exception as e:
+        log.error(f"Could not release claimed capsules: {e}")
+
 # Move scheduler initialization and start outside the if __name__ == '__main__': block
 # This ensures it runs when the module is imported by Gunicorn
 try:
-    scheduler.init_app(app)
-    # The scheduler trigger is set to run every 1 minute for testing purposes.
-    # You might want to adjust this interval in a production environment.
-    scheduler.add_job(id='send_emails_job', func=send_scheduled_emails, trigger='interval', minutes=1)
-    scheduler.start()
-    log.info("Scheduler initialized and started successfully.")
+    if acquire_scheduler_lock():
+        scheduler.init_app(app)
+        recover_claimed_capsules()
+        requeue_staged_uploads()
+        scheduler.add_job(id='requeue_uploads_job', func=requeue_staged_uploads, trigger='interval', seconds=UPLOAD_REQUEUE_INTERVAL,
+                          kwargs={'min_age': UPLOAD_REQUEUE_AGE}, replace_existing=True)
+        # Polls every SCHEDULER_INTERVAL seconds, backing off while there is nothing to send
+        # SCHEDULER_JOB_DEFAULTS keep this to one run at a time, so a slow SMTP batch delays the next poll
+        # instead of stacking runs up behind it
+        scheduler.add_job(id='send_emails_job', func=poll_scheduled_emails, trigger='interval', seconds=SCHEDULER_INTERVAL,
+                          misfire_grace_time=SCHEDULER_MISFIRE_GRACE, replace_existing=True)
+        scheduler.start()
+        log.info("Scheduler initialized and started successfully.")
+    else:
+        log.info(f"Scheduler lock {SCHEDULER_LOCK_FILE} is held by another process. Not starting scheduler here.")
 except Exception as e:
     log.error(f"Failed to initialize or start scheduler: {e}")
 
@@ -529,6 +1571,13 @@ if __name__ == '__main__':
                     log.info("Added 'error_message' column successfully.")
                 else:
                      log.info("'error_message' column already exists.")
+                # db.create_all() skips existing tables, so add indexes introduced later here
+                with db.engine.begin() as connection:
+                    connection.execute(db.text("CREATE INDEX IF NOT EXISTS ix_capsule_unsent ON capsule (send_datetime_utc) WHERE status IN ('pending', 'failed')"))
+                    connection.execute(db.text('CREATE INDEX IF NOT EXISTS ix_capsule_created_at ON capsule (created_at)'))
+                    # Replaced by the partial ix_capsule_unsent
+                    connection.execute(db.text('DROP INDEX IF EXISTS ix_capsule_status_send'))
+                log.info("Indexes 'ix_capsule_unsent' and 'ix_capsule_created_at' checked/created.")
             else:
                  log.info("Table 'capsule' does not exist yet. It will be created by db.create_all().")
 
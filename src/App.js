@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { AlertCircle, CheckCircle, Clock, Trash2, Plus, Send, Paperclip, X, Download, Clock3, AlertTriangle, Sparkles } from 'lucide-react';
 
 // --- Configuration ---
@@ -6,6 +6,10 @@ import { AlertCircle, CheckCircle, Clock, Trash2, Plus, Send, Paperclip, X, Down
 // when accessing from other devices on your network (like your phone).
 // Example: 'http://192.168.1.100:5000/api'
 const API_BASE_URL = `http://localhost:5078/api`; // Use template literal for easier IP change
+const CAPSULE_PAGE_SIZE = 50; // Capsules fetched per page of the list
+
+// Capsules are listed by send date, soonest first
+const sortBySendDate = (capsules) => [...capsules].sort((a, b) => new Date(a.send_datetime) - new Date(b.send_datetime));
 
 // Simple Modal Component
 const Modal = ({ isOpen, onClose, title, children }) => {
@@ -58,6 +62,9 @@ const Spinner = ({ size = 'h-8 w-8', color = 'border-blue-500' }) => ( // Added
 // --- Main Application Component ---
 function App() {
   const [capsules, setCapsules] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null); // Cursor for the next page, null when all are loaded
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
+  const loadedMoreRef = useRef(false); // Whether pages past the first have been loaded
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState(null);
   const [successMessage, setSuccessMessage] = useState(null);
@@ -87,7 +94,8 @@ function App() {
     setIsLoading(true);
     // Don't clear errors/success messages on auto-refresh, only on user action
     try {
-      const response = await fetch(`${API_BASE_URL}/capsules`);
+      // Only the newest page is refreshed; pages added with "Load more" are kept below it
+      const response = await fetch(`${API_BASE_URL}/capsules?include=error_message&limit=${CAPSULE_PAGE_SIZE}`);
       if (!response.ok) {
         // Only set error if it's a new error, don't overwrite existing ones from user actions
         if (!error) {
@@ -95,10 +103,20 @@ function App() {
         }
         throw new Error(`HTTP error! status: ${response.status}`);
       }
-      const data = await response.json();
-      // Sort capsules, e.g., by send date or creation date
-      data.sort((a, b) => new Date(a.send_datetime) - new Date(b.send_datetime));
-      setCapsules(data);
+      const page = await response.json();
+      if (!loadedMoreRef.current || !page.next_cursor) {
+        loadedMoreRef.current = false;
+        setNextCursor(page.next_cursor);
+        setCapsules(sortBySendDate(page.items));
+      } else {
+        // Keep the older capsules already loaded, dropping any now in the refreshed page
+        const ids = new Set(page.items.map(capsule => capsule.id));
+        const oldest = new Date(page.items[page.items.length - 1].created_at);
+        setCapsules(prev => sortBySendDate([
+          ...page.items,
+          ...prev.filter(capsule => !ids.has(capsule.id) && new Date(capsule.created_at) <= oldest),
+        ]));
+      }
       // Clear fetch-related errors on success
       if (error && error.includes('Failed to load capsules')) {
            setError(null);
@@ -114,6 +132,29 @@ function App() {
     }
   }, [error]); // Added error to dependency array
 
+  const loadMoreCapsules = async () => {
+    if (!nextCursor) return;
+    setIsLoadingMore(true);
+    try {
+      const response = await fetch(`${API_BASE_URL}/capsules?include=error_message&limit=${CAPSULE_PAGE_SIZE}&cursor=${encodeURIComponent(nextCursor)}`);
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      const page = await response.json();
+      loadedMoreRef.current = true;
+      setCapsules(prev => {
+        const ids = new Set(prev.map(capsule => capsule.id));
+        return sortBySendDate([...prev, ...page.items.filter(capsule => !ids.has(capsule.id))]);
+      });
+      setNextCursor(page.next_cursor);
+    } catch (e) {
+      console.error("Failed to load more capsules:", e);
+      setError('Failed to load more capsules. Please try again.');
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
   const addCapsule = async (capsuleData) => {
     setIsSubmitting(true);
     setError(null); // Clear general errors on new submission
@@ -126,8 +167,6 @@ function App() {
       const localDate = new Date(capsuleData.sendDate);
       const utcDateString = localDate.toISOString(); // Always UTC
       formData.append('send_datetime', utcDateString);
-
-      formData.append('send_datetime', capsuleData.sendDate);
       if (capsuleData.attachment) {
         formData.append('attachment', capsuleData.attachment);
       }
@@ -143,7 +182,7 @@ function App() {
       }
 
       const newCapsule = await response.json();
-      setCapsules(prev => [...prev, newCapsule].sort((a, b) => new Date(a.send_datetime) - new Date(b.send_datetime)));
+      setCapsules(prev => sortBySendDate([...prev, newCapsule]));
       setSuccessMessage('Time capsule created successfully!');
       resetForm();
       setIsFormModalOpen(false);
@@ -278,9 +317,19 @@ function App() {
       setAiError(null); // Also close AI errors
   }
 
-  const openDetailModal = (capsule) => {
+  const openDetailModal = async (capsule) => {
     setSelectedCapsule(capsule);
     setIsDetailModalOpen(true);
+    // The list doesn't include the message body; load the full capsule for the details view
+    try {
+      const response = await fetch(`${API_BASE_URL}/capsules/${capsule.id}`);
+      if (response.ok) {
+        const fullCapsule = await response.json();
+        setSelectedCapsule(current => (current && current.id === fullCapsule.id ? fullCapsule : current));
+      }
+    } catch (e) {
+      console.error("Failed to fetch capsule details:", e);
+    }
   };
 
   const closeDetailModal = () => {
@@ -415,6 +464,17 @@ function App() {
               ))}
             </ul>
           )}
+          {nextCursor && (
+            <div className="flex justify-center mt-4">
+              <button
+                onClick={loadMoreCapsules}
+                disabled={isLoadingMore}
+                className="px-4 py-2 bg-indigo-600 text-white rounded-md hover:bg-indigo-700 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-indigo-500 transition duration-150 inline-flex items-center disabled:opacity-50 disabled:cursor-not-allowed"
+              >
+                {isLoadingMore ? <Spinner size="h-5 w-5" color="border-white" /> : 'Load more'}
+              </button>
+            </div>
+          )}
         </div>
       </main>
 